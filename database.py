@@ -5,11 +5,12 @@ MongoDB helper functions ready to use in your backend code.
 Import and use these functions in your API endpoints for database operations.
 """
 
-from pymongo import MongoClient
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
 from datetime import datetime, timezone
 import os
 from dotenv import load_dotenv
-from typing import Union
+from typing import List, Union
 from pydantic import BaseModel
 
 # Load environment variables from .env file
@@ -21,12 +22,24 @@ db = None
 database_url = os.getenv("DATABASE_URL")
 database_name = os.getenv("DATABASE_NAME")
 
-if database_url and database_name:
-    _client = MongoClient(database_url)
-    db = _client[database_name]
+def connect():
+    """Create this process's client; call from a startup hook so each worker owns its pool"""
+    global _client, db
+    if _client is None and database_url and database_name:
+        _client = AsyncIOMotorClient(database_url)
+        db = _client[database_name]
+    return db
+
+def close():
+    """Close this process's client"""
+    global _client, db
+    if _client is not None:
+        _client.close()
+    _client = None
+    db = None
 
 # Helper functions for common database operations
-def create_document(collection_name: str, data: Union[BaseModel, dict]):
+async def create_document(collection_name: str, data: Union[BaseModel, dict]):
     """Insert a single document with timestamp"""
     if db is None:
         raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
@@ -40,16 +53,37 @@ def create_document(collection_name: str, data: Union[BaseModel, dict]):
     data_dict['created_at'] = datetime.now(timezone.utc)
     data_dict['updated_at'] = datetime.now(timezone.utc)
 
-    result = db[collection_name].insert_one(data_dict)
+    result = await db[collection_name].insert_one(data_dict)
     return str(result.inserted_id)
 
-def get_documents(collection_name: str, filter_dict: dict = None, limit: int = None):
+async def create_documents_if_missing(collection_name: str, key: str, data: List[Union[BaseModel, dict]]):
+    """Insert documents whose key value is not already present, in a single bulk upsert"""
+    if db is None:
+        raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
+    if not data:
+        return []
+
+    now = datetime.now(timezone.utc)
+    ops = []
+    for item in data:
+        item_dict = item.model_dump() if isinstance(item, BaseModel) else item.copy()
+        item_dict['created_at'] = now
+        item_dict['updated_at'] = now
+        ops.append(UpdateOne({key: item_dict[key]}, {"$setOnInsert": item_dict}, upsert=True))
+
+    result = await db[collection_name].bulk_write(ops, ordered=False)
+    return [str(inserted_id) for inserted_id in result.upserted_ids.values()]
+
+async def get_documents(collection_name: str, filter_dict: dict = None, limit: int = None,
+                        skip: int = 0, projection: dict = None):
     """Get documents from collection"""
     if db is None:
         raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
     
-    cursor = db[collection_name].find(filter_dict or {})
+    cursor = db[collection_name].find(filter_dict or {}, projection)
+    if skip:
+        cursor = cursor.skip(skip)
     if limit:
         cursor = cursor.limit(limit)
     
-    return list(cursor)
+    return await cursor.to_list(length=limit)
@@ -1,46 +1,201 @@
+import asyncio
+import base64
+import logging
 import os
-from typing import List, Optional
+import re
+from datetime import datetime
+from typing import Optional
+import orjson
 from fastapi import FastAPI, HTTPException, Query
-from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, EmailStr
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from pydantic import BaseModel
 from bson.objectid import ObjectId
+from pymongo.errors import ConnectionFailure, DuplicateKeyError, PyMongoError
 
-from database import db, create_document, get_documents
+import database
+from database import create_document, create_documents_if_missing
+from middleware import FastCORS
 from schemas import User, TherapistAvailability, BookingRequest, Message, JournalEntry
 
-app = FastAPI(title="Psylio-style Backend")
+logger = logging.getLogger(__name__)
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+_OID_RE = re.compile(r"[0-9a-fA-F]{24}")
+
+app = FastAPI(title="Psylio-style Backend", default_response_class=ORJSONResponse)
+
+app.add_middleware(FastCORS, expose_headers=["X-Next-Cursor"])
+app.add_middleware(GZipMiddleware, minimum_size=512)
+
+
+def _bson_default(obj):
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    raise TypeError
+
+
+def dumps_bson(content) -> bytes:
+    return orjson.dumps(content, default=_bson_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+class MongoJSONResponse(ORJSONResponse):
+    """orjson response that also serializes ObjectIds, so raw documents can be returned as-is"""
+
+    def render(self, content) -> bytes:
+        return dumps_bson(content)
 
 
 def to_str_id(doc):
+    """Rename _id to id and hex-encode top-level ObjectIds, mutating doc in place"""
     if not doc:
         return doc
-    d = dict(doc)
-    if d.get("_id"):
-        d["id"] = str(d.pop("_id"))
-    # convert nested ObjectIds if any
-    for k, v in list(d.items()):
-        if isinstance(v, ObjectId):
-            d[k] = str(v)
-        if isinstance(v, list):
-            d[k] = [str(x) if isinstance(x, ObjectId) else x for x in v]
-    return d
+    _id = doc.pop("_id", None)
+    if _id is not None:
+        doc["id"] = _id.binary.hex() if type(_id) is ObjectId else str(_id)
+    for k, v in doc.items():
+        t = type(v)
+        if t is ObjectId:
+            doc[k] = v.binary.hex()
+        elif t is list and v and type(v[0]) is ObjectId:
+            doc[k] = [x.binary.hex() for x in v]
+    return doc
+
+
+def normalize_email(email: str) -> str:
+    """Match EmailStr normalization (lowercased domain) without full validation"""
+    local, _, domain = email.strip().rpartition("@")
+    return f"{local}@{domain.lower()}" if local else email.strip()
+
+
+def encode_cursor(doc) -> str:
+    """Opaque keyset cursor pointing just past doc"""
+    raw = f"{doc['created_at'].isoformat()}:{doc['_id']}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def keyset_filter(after: str, descending: bool = False) -> dict:
+    """Filter selecting documents after the given cursor in (created_at, _id) order"""
+    try:
+        ts, _, oid = base64.urlsafe_b64decode(after.encode()).decode().rpartition(":")
+        ts = datetime.fromisoformat(ts)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not _OID_RE.fullmatch(oid):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    op = "$lt" if descending else "$gt"
+    return {"$or": [
+        {"created_at": {op: ts}},
+        {"created_at": ts, "_id": {op: ObjectId(oid)}},
+    ]}
+
+
+async def keyset_page(cursor, limit: int):
+    """Materialize one page; X-Next-Cursor is set only when more may follow"""
+    docs = await cursor.to_list(length=limit)
+    headers = {"X-Next-Cursor": encode_cursor(docs[-1])} if len(docs) == limit else None
+    return MongoJSONResponse([to_str_id(d) for d in docs], headers=headers)
+
+
+def stream_documents(cursor) -> StreamingResponse:
+    """Stream a cursor as a JSON array one document at a time, for unbounded lists"""
+    async def body():
+        prefix = b"["
+        async for d in cursor:
+            yield prefix + dumps_bson(to_str_id(d))
+            prefix = b","
+        yield b"]" if prefix == b"," else b"[]"
+
+    return StreamingResponse(body(), media_type="application/json")
+
+
+def _backfill_lc(db, field):
+    # lowercased shadow copy for users inserted before the *_lc fields existed
+    return db["user"].update_many(
+        {f"{field}_lc": {"$exists": False}},
+        [{"$set": {f"{field}_lc": {
+            "$map": {"input": {"$ifNull": [f"${field}", []]}, "in": {"$toLower": "$$this"}},
+        }}}],
+    )
+
+
+@app.on_event("startup")
+async def connect_database():
+    db = database.connect()
+    if db is None:
+        return
+    # index builds and backfills only speed queries up, so a failure is logged
+    # and startup continues in a degraded state rather than taking the API down
+    steps = [
+        ("text index on user", lambda: db["user"].create_index(
+            [("name", "text"), ("bio", "text"), ("specialties", "text")],
+            default_language="english",
+        )),
+        # databases from before the unique index may already hold duplicate emails
+        ("unique index on user.email (clean up duplicate emails)",
+         lambda: db["user"].create_index("email", unique=True)),
+        ("index on user.specialties_lc", lambda: db["user"].create_index("specialties_lc")),
+        ("index on user.languages_lc", lambda: db["user"].create_index("languages_lc")),
+        ("backfill of user.specialties_lc", lambda: _backfill_lc(db, "specialties")),
+        ("backfill of user.languages_lc", lambda: _backfill_lc(db, "languages")),
+        # compound indexes follow filter fields, then the sort key
+        ("thread index on message", lambda: db["message"].create_index(
+            [("thread_id", 1), ("created_at", 1), ("_id", 1)]
+        )),
+        ("therapist/client index on message", lambda: db["message"].create_index(
+            [("therapist_id", 1), ("client_email", 1), ("created_at", 1), ("_id", 1)]
+        )),
+        ("client index on journalentry", lambda: db["journalentry"].create_index(
+            [("client_email", 1), ("created_at", -1), ("_id", -1)]
+        )),
+        ("index on bookingrequest.therapist_id",
+         lambda: db["bookingrequest"].create_index("therapist_id")),
+        ("index on bookingrequest.client_email",
+         lambda: db["bookingrequest"].create_index("client_email")),
+    ]
+    for description, step in steps:
+        try:
+            await step()
+        except ConnectionFailure as e:
+            logger.warning("Database unreachable, skipping index setup: %s", e)
+            return
+        except PyMongoError as e:
+            logger.warning("Skipped %s: %s", description, e)
+
+
+@app.on_event("startup")
+async def warm_up_database():
+    # open and authenticate pooled connections before the first real request
+    if database.db is None:
+        return
+    try:
+        await database.db.command("ping")
+        await asyncio.gather(*[
+            database.db[c].find_one({}) for c in ("user", "message", "journalentry", "bookingrequest")
+        ])
+    except PyMongoError as e:
+        logger.warning("Database warm-up skipped: %s", e)
+
+
+@app.on_event("shutdown")
+async def close_database():
+    database.close()
+
+
+def with_lc_fields(user: User) -> dict:
+    """Dump a user with lowercased shadow copies of the filterable list fields"""
+    data = user.model_dump()
+    data["specialties_lc"] = [s.lower() for s in user.specialties]
+    data["languages_lc"] = [lang.lower() for lang in user.languages]
+    return data
 
 
 @app.get("/")
-def read_root():
+async def read_root():
     return {"message": "Psylio-style API running"}
 
 
 @app.get("/test")
-def test_database():
+async def test_database():
     response = {
         "backend": "✅ Running",
         "database": "❌ Not Available",
@@ -50,13 +205,13 @@ def test_database():
         "collections": []
     }
     try:
-        if db is not None:
+        if database.db is not None:
             response["database"] = "✅ Available"
             response["database_url"] = "✅ Set" if os.getenv("DATABASE_URL") else "❌ Not Set"
-            response["database_name"] = db.name if hasattr(db, 'name') else "Unknown"
+            response["database_name"] = database.db.name if hasattr(database.db, 'name') else "Unknown"
             response["connection_status"] = "Connected"
             try:
-                response["collections"] = db.list_collection_names()
+                response["collections"] = await database.db.list_collection_names()
                 response["database"] = "✅ Connected & Working"
             except Exception as e:
                 response["database"] = f"⚠️ Connected but Error: {str(e)[:80]}"
@@ -71,128 +226,185 @@ class SchemaInfo(BaseModel):
     schema: dict
 
 
-@app.get("/schema", response_model=List[SchemaInfo])
-def get_schema():
-    models = [
-        ("user", User.model_json_schema()),
-        ("therapistavailability", TherapistAvailability.model_json_schema()),
-        ("bookingrequest", BookingRequest.model_json_schema()),
-        ("message", Message.model_json_schema()),
-        ("journalentry", JournalEntry.model_json_schema()),
-    ]
-    return [SchemaInfo(name=name, schema=schema) for name, schema in models]
+# schemas are static for the lifetime of the process, so build them once
+_SCHEMA_CACHE = [
+    {"name": name, "schema": model.model_json_schema()}
+    for name, model in (
+        ("user", User),
+        ("therapistavailability", TherapistAvailability),
+        ("bookingrequest", BookingRequest),
+        ("message", Message),
+        ("journalentry", JournalEntry),
+    )
+]
+
+
+@app.get("/schema")
+async def get_schema():
+    # already well-formed, so skip response_model re-validation
+    return ORJSONResponse(_SCHEMA_CACHE)
 
 
 # ---------- Therapists (directory) ----------
+THERAPIST_LIST_FIELDS = {
+    "email": 1, "name": 1, "specialties": 1, "languages": 1, "virtual": 1,
+    "in_person": 1, "fee_min": 1, "fee_max": 1, "photo_url": 1, "location": 1,
+}
+
+
 @app.get("/api/therapists")
-def list_therapists(
+async def list_therapists(
     search: Optional[str] = None,
     specialty: Optional[str] = None,
     language: Optional[str] = None,
     virtual: Optional[bool] = None,
     in_person: Optional[bool] = None,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(50, ge=1, le=200),
 ):
     query = {"role": "therapist"}
     if search:
-        # simple regex OR across name and bio
-        query["$or"] = [
-            {"name": {"$regex": search, "$options": "i"}},
-            {"bio": {"$regex": search, "$options": "i"}},
-            {"specialties": {"$elemMatch": {"$regex": search, "$options": "i"}}},
-        ]
+        # backed by the text index on name, bio and specialties
+        query["$text"] = {"$search": search}
     if specialty:
-        query["specialties"] = {"$elemMatch": {"$regex": specialty, "$options": "i"}}
+        query["specialties_lc"] = specialty.lower()
     if language:
-        query["languages"] = {"$elemMatch": {"$regex": language, "$options": "i"}}
+        query["languages_lc"] = language.lower()
     if virtual is not None:
         query["virtual"] = virtual
     if in_person is not None:
         query["in_person"] = in_person
 
-    docs = get_documents("user", query, limit=None)
-    return [to_str_id(d) for d in docs]
+    # a stable order keeps consecutive pages from repeating or dropping therapists
+    sort = {"score": {"$meta": "textScore"}, "_id": 1} if search else {"_id": 1}
+    # match first, then page and count in the same round-trip
+    pipeline = [
+        {"$match": query},
+        {"$sort": sort},
+        {"$facet": {
+            "results": [{"$skip": skip}, {"$limit": limit}, {"$project": THERAPIST_LIST_FIELDS}],
+            "total": [{"$count": "n"}],
+        }},
+    ]
+    out = await database.db["user"].aggregate(pipeline).to_list(1)
+    page = out[0]
+    return MongoJSONResponse({
+        "results": [to_str_id(d) for d in page["results"]],
+        "total": page["total"][0]["n"] if page["total"] else 0,
+    })
 
 
 @app.post("/api/therapists")
-def create_therapist(therapist: User):
+async def create_therapist(therapist: User):
     if therapist.role != "therapist":
         raise HTTPException(status_code=400, detail="role must be 'therapist'")
-    inserted_id = create_document("user", therapist)
+    try:
+        inserted_id = await create_document("user", with_lc_fields(therapist))
+    except DuplicateKeyError:
+        raise HTTPException(status_code=409, detail="email already registered")
     return {"id": inserted_id}
 
 
 @app.get("/api/therapists/{therapist_id}")
-def get_therapist(therapist_id: str):
-    try:
-        doc = db["user"].find_one({"_id": ObjectId(therapist_id)})
-        if not doc:
-            raise HTTPException(status_code=404, detail="Not found")
-        return to_str_id(doc)
-    except Exception:
+async def get_therapist(therapist_id: str):
+    if not _OID_RE.fullmatch(therapist_id):
         raise HTTPException(status_code=400, detail="Invalid id")
+    doc = await database.db["user"].find_one({"_id": ObjectId(therapist_id)})
+    if not doc:
+        raise HTTPException(status_code=404, detail="Not found")
+    return MongoJSONResponse(to_str_id(doc))
 
 
 # ---------- Booking Requests ----------
 @app.post("/api/booking-requests")
-def create_booking(req: BookingRequest):
-    inserted_id = create_document("bookingrequest", req)
+async def create_booking(req: BookingRequest):
+    inserted_id = await create_document("bookingrequest", req)
     return {"id": inserted_id}
 
 
 @app.get("/api/booking-requests")
-def list_bookings(
+async def list_bookings(
     therapist_id: Optional[str] = None,
-    client_email: Optional[EmailStr] = None,
+    client_email: Optional[str] = None,
 ):
     query = {}
     if therapist_id:
         query["therapist_id"] = therapist_id
     if client_email:
-        query["client_email"] = str(client_email)
-    docs = get_documents("bookingrequest", query)
-    return [to_str_id(d) for d in docs]
+        query["client_email"] = normalize_email(client_email)
+    return stream_documents(database.db["bookingrequest"].find(query))
 
 
 # ---------- Messages ----------
+MESSAGE_LIST_FIELDS = {
+    "therapist_id": 1, "client_email": 1, "from_email": 1, "to_email": 1,
+    "content": 1, "thread_id": 1, "created_at": 1,
+}
+
+
 @app.post("/api/messages")
-def send_message(msg: Message):
-    inserted_id = create_document("message", msg)
+async def send_message(msg: Message):
+    inserted_id = await create_document("message", msg)
     return {"id": inserted_id}
 
 
 @app.get("/api/messages")
-def list_messages(
+async def list_messages(
     therapist_id: Optional[str] = None,
-    client_email: Optional[EmailStr] = None,
+    client_email: Optional[str] = None,
     thread_id: Optional[str] = None,
+    after: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=200),
 ):
     query = {}
     if therapist_id:
         query["therapist_id"] = therapist_id
     if client_email:
-        query["client_email"] = str(client_email)
+        query["client_email"] = normalize_email(client_email)
     if thread_id:
         query["thread_id"] = thread_id
-    docs = db["message"].find(query).sort("created_at", 1)
-    return [to_str_id(d) for d in docs]
+    if after:
+        query.update(keyset_filter(after))
+    cursor = (
+        database.db["message"]
+        .find(query, MESSAGE_LIST_FIELDS)
+        .sort([("created_at", 1), ("_id", 1)])
+        .limit(limit)
+    )
+    return await keyset_page(cursor, limit)
 
 
 # ---------- Journal ----------
+JOURNAL_LIST_FIELDS = {"client_email": 1, "title": 1, "content": 1, "mood": 1, "created_at": 1}
+
+
 @app.post("/api/journal")
-def create_journal(entry: JournalEntry):
-    inserted_id = create_document("journalentry", entry)
+async def create_journal(entry: JournalEntry):
+    inserted_id = await create_document("journalentry", entry)
     return {"id": inserted_id}
 
 
 @app.get("/api/journal")
-def list_journal(client_email: EmailStr):
-    docs = db["journalentry"].find({"client_email": str(client_email)}).sort("created_at", -1)
-    return [to_str_id(d) for d in docs]
+async def list_journal(
+    client_email: str,
+    after: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=200),
+):
+    query = {"client_email": normalize_email(client_email)}
+    if after:
+        query.update(keyset_filter(after, descending=True))
+    cursor = (
+        database.db["journalentry"]
+        .find(query, JOURNAL_LIST_FIELDS)
+        .sort([("created_at", -1), ("_id", -1)])
+        .limit(limit)
+    )
+    return await keyset_page(cursor, limit)
 
 
 # ---------- Seed sample data ----------
 @app.post("/seed")
-def seed():
+async def seed():
     sample = [
         User(
             role="therapist",
@@ -240,16 +452,19 @@ def seed():
             years_experience=6,
         ),
     ]
-    inserted = []
-    for s in sample:
-        # idempotent-ish: avoid duplicates by email
-        existing = db["user"].find_one({"email": s.email})
-        if not existing:
-            inserted.append(create_document("user", s))
+    # idempotent: upsert keyed on the unique email index
+    inserted = await create_documents_if_missing("user", "email", [with_lc_fields(s) for s in sample])
     return {"inserted": inserted, "count": len(inserted)}
 
 
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=port,
+        loop="uvloop",
+        http="httptools",
+        workers=int(os.getenv("WEB_CONCURRENCY", 1)),
+    )
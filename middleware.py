@@ -0,0 +1,69 @@
+"""
+ASGI middleware
+
+Lightweight replacements for Starlette middleware on the hot request path.
+"""
+
+_ALLOW_METHODS = b"DELETE, GET, HEAD, OPTIONS, PATCH, POST, PUT"
+_MAX_AGE = b"600"
+
+
+class FastCORS:
+    """Open CORS policy (any origin, method and header, with credentials)
+
+    Behaves like CORSMiddleware configured with "*" everywhere and
+    allow_credentials=True, but with the response headers pre-baked: the
+    requesting origin is echoed back, preflights are answered directly
+    without reaching the app, and non-CORS requests pass through untouched.
+    """
+
+    def __init__(self, app, expose_headers=()):
+        self.app = app
+        self.simple_headers = [
+            (b"access-control-allow-credentials", b"true"),
+            (b"vary", b"Origin"),
+        ]
+        if expose_headers:
+            self.simple_headers.append(
+                (b"access-control-expose-headers", ", ".join(expose_headers).encode("latin-1"))
+            )
+        self.preflight_headers = [
+            (b"access-control-allow-methods", _ALLOW_METHODS),
+            (b"access-control-allow-credentials", b"true"),
+            (b"access-control-max-age", _MAX_AGE),
+            (b"vary", b"Origin"),
+        ]
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        origin = None
+        request_method = None
+        request_headers = None
+        for key, value in scope["headers"]:
+            if key == b"origin":
+                origin = value
+            elif key == b"access-control-request-method":
+                request_method = value
+            elif key == b"access-control-request-headers":
+                request_headers = value
+        if origin is None:
+            return await self.app(scope, receive, send)
+
+        if scope["method"] == "OPTIONS" and request_method is not None:
+            headers = [(b"access-control-allow-origin", origin), *self.preflight_headers]
+            if request_headers is not None:
+                headers.append((b"access-control-allow-headers", request_headers))
+            await send({"type": "http.response.start", "status": 204, "headers": headers})
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        cors_headers = [(b"access-control-allow-origin", origin), *self.simple_headers]
+
+        async def send_with_cors(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", ()), *cors_headers]
+            await send(message)
+
+        await self.app(scope, receive, send_with_cors)
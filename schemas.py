@@ -5,11 +5,17 @@ Each Pydantic model name maps to a MongoDB collection with the lowercase
 class name (e.g., User -> "user").
 """
 
-from pydantic import BaseModel, Field, EmailStr
+from pydantic import BaseModel, ConfigDict, Field, EmailStr
 from typing import List, Optional
 
 
-class User(BaseModel):
+class CollectionModel(BaseModel):
+    """Base for the collection models (not a collection itself): rejects unknown
+    fields and strips whitespace from strings"""
+    model_config = ConfigDict(extra="forbid", str_strip_whitespace=True)
+
+
+class User(CollectionModel):
     """User collection: both clients and therapists"""
     role: str = Field(..., description="client or therapist")
     name: str
@@ -28,7 +34,7 @@ class User(BaseModel):
     certifications: List[str] = Field(default_factory=list)
 
 
-class TherapistAvailability(BaseModel):
+class TherapistAvailability(CollectionModel):
     therapist_id: str
     weekday: int = Field(..., ge=0, le=6, description="0=Mon .. 6=Sun")
     time_ranges: List[str] = Field(..., description="e.g., ['09:00-12:00','14:00-17:00']")
@@ -36,7 +42,7 @@ class TherapistAvailability(BaseModel):
     in_person: bool = False
 
 
-class BookingRequest(BaseModel):
+class BookingRequest(CollectionModel):
     therapist_id: str
     client_name: str
     client_email: EmailStr
@@ -45,7 +51,7 @@ class BookingRequest(BaseModel):
     status: str = Field(default="pending", description="pending|accepted|declined|completed")
 
 
-class Message(BaseModel):
+class Message(CollectionModel):
     therapist_id: str
     client_email: EmailStr
     from_email: EmailStr
@@ -54,7 +60,7 @@ class Message(BaseModel):
     thread_id: Optional[str] = None
 
 
-class JournalEntry(BaseModel):
+class JournalEntry(CollectionModel):
     client_email: EmailStr
     title: str
     content: str